@@ -1,7 +1,13 @@
 import pandas as pd
 import datetime as dt
 import numpy as np
+import concurrent.futures
+import hashlib
+import itertools
+import mmap
 import os
+import re
+import warnings
 import yaml
 
 class obs_sequence:
@@ -9,7 +15,7 @@ class obs_sequence:
 
     Attributes:
         df (pandas.DataFrame): DataFrame containing all the observations.
-        all_obs (list): List of all observations, each observation is a list.
+        cache_file (str): The parquet file the DataFrame is saved to, None if cache is False.
         header (str): Header from the ascii file.
         vert (dict): Dictionary of dart vertical units.
         types (dict): Dictionary of types in the observation sequence file.
@@ -19,6 +25,13 @@ class obs_sequence:
    
     Parameters:
         file : the input observation sequence ascii file
+        chunksize : the number of observations converted at a time, default 20000.
+            Smaller values lower the peak memory used reading the file.
+        cache : save the DataFrame to file + '.parquet' and read it from there next time,
+            instead of parsing the ascii file again, default False. The saved DataFrame
+            is used only if it is newer than the file. Needs pyarrow (or fastparquet).
+        n_workers : the number of processes parsing the file, default 1.
+            None uses every CPU. Worth it for large files on multicore machines.
 
     Example: 
         Read the observation sequence from file:
@@ -55,6 +68,13 @@ class obs_sequence:
 
     reversed_vert = {value: key for key, value in vert.items()}
 
+    # sorted dart vertical codes, the position of a code is its vert_unit category code
+    vert_codes = np.array(sorted(vert))
+    vert_categories = [unit for _, unit in sorted(vert.items())]
+    # lookup table from a dart vertical code - vert_codes[0] to its vert_unit category code, -1 if not in vert
+    vert_remap = np.full(vert_codes[-1] - vert_codes[0] + 1, -1)
+    vert_remap[vert_codes - vert_codes[0]] = np.arange(len(vert_codes))
+
     # synonyms for observation
     synonyms_for_obs = ['NCEP BUFR observation',
                         'AIRS observation', 
@@ -62,80 +82,201 @@ class obs_sequence:
                         'SST observation',
                         'observations']
     
-    def __init__(self, file):
+    def __init__(self, file, chunksize=20000, cache=False, n_workers=1):
         self.loc_mod = 'None'
         self.file = file
         self.header = self.read_header(file)
         self.types = self.collect_obs_types(self.header)
         self.reverse_types = {v: k for k, v in self.types.items()}
         self.copie_names, self.n_copies = self.collect_copie_names(self.header)
-        self.seq = self.obs_reader(file, self.n_copies)
-        self.all_obs = self.create_all_obs() # uses up the generator
+        self.synonyms_for_obs = [synonym.replace(' ', '_') for synonym in self.synonyms_for_obs]
+        self.cache_file = os.fspath(file) + '.parquet' if cache else None
+        # the key is taken before parsing, so a file changed during the parse is not cached as current
+        cache_key = self.cache_key() if cache else None
+        self.df = self.read_cache(cache_key) if cache else None
+        if self.df is not None:
+            # DataFrame saved by an earlier read of the same file, skip parsing
+            self.loc_mod = 'loc3d' if 'longitude' in self.df.columns else 'loc1d'
+        else:
+            self.df = self.create_df(file, chunksize, n_workers)
+            if cache:
+                self.write_cache(cache_key)
+        self.obs_to_list = self.make_obs_to_list()
+        self.columns = self.column_headers()
+        module_dir = os.path.dirname(__file__)
+        self.default_composite_types = os.path.join(module_dir,"composite_types.yaml")
+
+    def cache_key(self):
+        """Identify the obs_seq file by its size, modification time and header, to check the cache against"""
+        stat = os.stat(self.file)
+        header = hashlib.sha256('\n'.join(self.header).encode()).hexdigest()
+        return f'{stat.st_size} {stat.st_mtime_ns} {header}'
+
+    def read_cache(self, key):
+        """Read the DataFrame saved by write_cache, None if there is no cache made with key
+
+           A cache file that cannot be read is ignored with a warning.
+        """
+        if not os.path.exists(self.cache_file):
+            return None
+        try:
+            df = pd.read_parquet(self.cache_file)
+        except (ImportError, OSError, ValueError) as e:
+            warnings.warn(f"Could not read the cache file {self.cache_file}, parsing {self.file}: {e}")
+            return None
+        if df.attrs.get('obs_seq_source') != key:
+            return None
+        df.attrs = {}
+        df['time'] = df['time'].astype('datetime64[s]')  # parquet has no second resolution
+        return df
+
+    def write_cache(self, key):
+        """Save self.df to the cache file, with key to check the cache against when it is read
+
+           The file is written under a temporary name and then moved into place, so
+           an interrupted write does not leave a truncated cache. If the cache cannot
+           be written there is a warning, self.df is still good.
+        """
+        temp_file = f'{self.cache_file}.{os.getpid()}.tmp'
+        df = self.df.copy(deep=False)  # the attrs are only for the file
+        df.attrs = {'obs_seq_source': key}
+        try:
+            df.to_parquet(temp_file, compression='zstd')
+            os.replace(temp_file, self.cache_file)
+        except (ImportError, OSError) as e:
+            warnings.warn(f"Could not write the cache file {self.cache_file}: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def create_df(self, file, chunksize, n_workers=1):
+        """Parse the observations in the obs_seq file into the DataFrame"""
+        copies, obs_columns = self.read_obs_columns(file, chunksize, n_workers)
         # at this point you know if the seq is loc3d or loc1d
         if self.loc_mod == 'None':
             raise ValueError("Neither 'loc3d' nor 'loc1d' could be found in the observation sequence.")
-        self.columns = self.column_headers()
-        self.df = pd.DataFrame(self.all_obs, columns = self.columns)
-        if self.loc_mod == 'loc3d':
-            self.df['longitude'] = np.rad2deg(self.df['longitude'])
-            self.df['latitude'] = np.rad2deg(self.df['latitude'])
+        columns = self.column_headers()
+        # The DataFrame takes over the copies array without copying it and the other
+        # columns are moved in one at a time, so the observations are never held twice
+        df = pd.DataFrame(copies, columns=self.copie_names, copy=False)
+        del copies
+        df.insert(0, 'obs_num', obs_columns.pop('obs_num'))
+        for name in columns[self.n_copies+1:]:
+            df[name] = obs_columns.pop(name)
         # rename 'X observation' to observation
-        self.synonyms_for_obs = [synonym.replace(' ', '_') for synonym in self.synonyms_for_obs]
-        rename_dict = {old: 'observation' for old in self.synonyms_for_obs  if old in self.df.columns}
-        self.df = self.df.rename(columns=rename_dict)
+        rename_dict = {old: 'observation' for old in self.synonyms_for_obs  if old in df.columns}
+        df.rename(columns=rename_dict, inplace=True)
         # calculate bias and sq_err is the obs_seq is an obs_seq.final
-        if 'prior_ensemble_mean'.casefold() in map(str.casefold, self.columns):
-            self.df['bias'] = (self.df['prior_ensemble_mean'] - self.df['observation'])
-            self.df['sq_err'] = self.df['bias']**2  # squared error
-        module_dir = os.path.dirname(__file__)
-        self.default_composite_types = os.path.join(module_dir,"composite_types.yaml")
+        if 'prior_ensemble_mean'.casefold() in map(str.casefold, columns):
+            df['bias'] = (df['prior_ensemble_mean'] - df['observation'])
+            df['sq_err'] = df['bias']**2  # squared error
+        return df
 
-    def create_all_obs(self):
-        """ steps through the generator to create a
-            list of all observations in the sequence 
-        """
-        all_obs = []
-        for obs in self.seq:
-            data = self.obs_to_list(obs)
-            all_obs.append(data)
-        return all_obs
+    def read_obs_columns(self, file, chunksize, n_workers=1):
+        """Read every observation in the obs_seq file into the copies and a dictionary of the other columns
 
-    def obs_to_list(self, obs):
-        """put single observation into a list
+           The memory mapped file is parsed by parse_obs_seq_core, or by
+           parse_obs_seq_parallel in n_workers processes, then the
+           observation types, vertical units and times are filled in for the
+           whole column at once. time is a datetime64[s] column.
 
            discards obs_def
         """
-        data = []
-        data.append(obs[0].split()[1]) # obs_num
-        data.extend(list(map(float,obs[1:self.n_copies+1]))) # all the copies
-        data.append(obs[self.n_copies+1]) # linked list info
-        try:  # HK todo only have to check loc3d or loc1d for the first observation, the whole file is the same
-            locI = obs.index('loc3d')
-            location = obs[locI+1].split()
-            data.append(float(location[0]))  # location x
-            data.append(float(location[1]))  # location y
-            data.append(float(location[2]))  # location z
-            data.append(obs_sequence.vert[int(location[3])])
-            self.loc_mod = 'loc3d'
-        except ValueError:
-            try:
-                locI = obs.index('loc1d')
-                location = obs[locI+1]
-                data.append(float(location))  # 1d location 
-                self.loc_mod = 'loc1d'
-            except ValueError:
-                raise ValueError("Neither 'loc3d' nor 'loc1d' could be found in the observation sequence.")
-        typeI = obs.index('kind') # type of observation
-        type_value = obs[typeI + 1]
-        data.append(self.types[type_value]) # observation type
-        # any observation specific obs def info is between here and the end of the list
-        time = obs[-2].split()
-        data.append(int(time[0])) # seconds
-        data.append(int(time[1])) # days
-        data.append(convert_dart_time(int(time[0]), int(time[1]))) # datetime   # HK todo what is approprate for 1d models?
-        data.append(float(obs[-1])) # obs error variance ?convert to sd?
-        
-        return data
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = _header_end.search(data).end()
+            # only have to check loc3d or loc1d for the first observation, the whole file is the same
+            loc_mod = _loc_mod.search(data, header_end)
+            if loc_mod is None:
+                return None, {}
+            self.loc_mod = loc_mod.group(1).decode()
+            if n_workers == 1:
+                (obs_num, copies, linked_list, location, vkind,
+                 kind, seconds, days, obs_err_var) = parse_obs_seq_core(data, self.n_copies, header_end, self.loc_mod, chunksize,
+                                                       n_obs=self.collect_num_obs(self.header))
+        if n_workers != 1:
+            (obs_num, copies, linked_list, location, vkind,
+             kind, seconds, days, obs_err_var) = parse_obs_seq_parallel(file, self.n_copies, header_end, self.loc_mod, chunksize, n_workers)
+
+        columns = {}
+        columns['obs_num'] = obs_num
+        columns['linked_list'] = linked_list
+        if self.loc_mod == 'loc3d':
+            # degrees in the DataFrame, converted in place before the DataFrame is built
+            np.rad2deg(location[:, :2], out=location[:, :2])
+            columns['longitude'] = location[:, 0]
+            columns['latitude'] = location[:, 1]
+            columns['vertical'] = location[:, 2]
+            # vertical units and types repeat a handful of values, so they are stored as
+            # pandas Categoricals: a small integer code per observation
+            vert_index = vkind - obs_sequence.vert_codes[0]
+            in_table = (vert_index >= 0) & (vert_index < len(obs_sequence.vert_remap))
+            vert_codes = obs_sequence.vert_remap[np.where(in_table, vert_index, 0)]
+            unknown = ~in_table | (vert_codes < 0)
+            if unknown.any():
+                raise KeyError(vkind[unknown][0])
+            columns['vert_unit'] = pd.Categorical.from_codes(vert_codes, categories=obs_sequence.vert_categories)
+        elif self.loc_mod == 'loc1d':
+            columns['location'] = location[:, 0]
+        # the type categories are sorted by name, so a groupby on type is in the same
+        # order as it is for strings
+        kinds, kind_index = np.unique(kind, return_inverse=True)
+        type_names = np.array([self.types[str(k)] for k in kinds.tolist()])
+        name_order = np.argsort(type_names)
+        name_codes = np.empty_like(name_order)
+        name_codes[name_order] = np.arange(len(name_order))
+        columns['type'] = pd.Categorical.from_codes(name_codes[kind_index], categories=type_names[name_order].tolist())
+        columns['seconds'] = seconds
+        columns['days'] = days
+        # same as convert_dart_time for the whole column at once.  datetime64[ns] cannot
+        # represent the 1601 base year, so the sum is done in seconds
+        columns['time'] = np.datetime64(_DART_EPOCH, 's') + (days * 86400 + seconds).astype('timedelta64[s]')
+        columns['obs_err_var'] = obs_err_var
+        return copies, columns
+
+    def make_obs_to_list(self):
+        """Create obs_to_list for this observation sequence
+
+           The number of copies, the location type and the types are fixed
+           in the returned function, so it does not look them up for every
+           observation. __init__ sets self.obs_to_list to it.
+        """
+        n = self.n_copies
+        copies = slice(1, n+1)
+        loc_parse = self._parse_loc3d if self.loc_mod == 'loc3d' else self._parse_loc1d
+        types = self.types
+
+        def obs_to_list(obs):
+            """put single observation into a list
+
+               discards obs_def
+            """
+            # any observation specific obs def info is between the type and the time
+            time = obs[-2].split()
+            seconds = int(time[0])
+            days = int(time[1])
+            return [obs[0].split()[1], # obs_num
+                    *map(float, obs[copies]), # all the copies
+                    obs[n+1].strip(), # linked list info
+                    # obs[n+2] is obdef, obs[n+3] is loc3d or loc1d
+                    *loc_parse(obs[n+4]), # location
+                    # obs[n+5] is kind
+                    types[obs[n+6].strip()], # observation type
+                    seconds,
+                    days,
+                    convert_dart_time(seconds, days), # datetime   # HK todo what is approprate for 1d models?
+                    float(obs[-1])] # obs error variance ?convert to sd?
+
+        return obs_to_list
+
+    @staticmethod
+    def _parse_loc3d(location):
+        """location x, y, z and vertical unit from a loc3d location line"""
+        location = location.split()
+        return [float(location[0]), float(location[1]), float(location[2]), obs_sequence.vert[int(location[3])]]
+
+    @staticmethod
+    def _parse_loc1d(location):
+        """1d location from a loc1d location line"""
+        return [float(location)]
 
     def list_to_obs(self, data):
         obs = []
@@ -183,7 +324,7 @@ class obs_sequence:
         
         Parameters:
             file (str): The path to the file where the observation sequence will be written.
-            df (pandas.DataFrame, optional): A DataFrame containing the observation data. If not provided, the function uses self.header and self.all_obs.
+            df (pandas.DataFrame, optional): A DataFrame containing the observation data. If not provided, the function uses self.header and self.df.
         
         Returns:
             None
@@ -192,7 +333,7 @@ class obs_sequence:
             ``obs_seq.write_obs_seq('/path/to/output/file')``
             ``obs_seq.write_obs_seq('/path/to/output/file', df=obs_seq.df)``
         """
-        with open(file, 'w') as f:
+        with open(file, 'w', buffering=io_buffer_size) as f:
             
             if df is not None:
                 # If a DataFrame is provided, update the header with the number of observations
@@ -227,13 +368,20 @@ class obs_sequence:
                 df_copy.apply(write_row, axis=1)
   
             else:
-                # If no DataFrame is provided, use self.header and self.all_obs
+                # If no DataFrame is provided, use self.header and the obs in self.df.
+                # self.file is not read again, so the obs_seq can be written over it
                 for line in self.header:
                     f.write(str(line) + '\n')
-                for obs in self.all_obs:
-                    ob_write = self.list_to_obs(obs)
-                    for line in ob_write:
-                        f.write(str(line) + '\n')
+                n_columns = len(self.columns)  # the columns of obs_to_list, without bias and sq_err
+                for start in range(0, len(self.df), 20000):
+                    rows = self.df.iloc[start:start + 20000, :n_columns]
+                    if self.loc_mod == 'loc3d':
+                        # back to radians for obs_seq
+                        rows = rows.assign(longitude=np.deg2rad(rows['longitude']), latitude=np.deg2rad(rows['latitude']))
+                    for obs in zip(*(rows[col].tolist() for col in rows.columns)):
+                        ob_write = self.list_to_obs(list(obs))
+                        for line in ob_write:
+                            f.write(str(line) + '\n')
 
 
     def column_headers(self):
@@ -296,47 +444,41 @@ class obs_sequence:
         copie_names = ['_'.join(x.split()) for x in header[first_copie:-1]] # first and last is last line of header
         return copie_names, len(copie_names)
 
+    @staticmethod
+    def collect_num_obs(header):
+        """
+        Extracts the number of observations from the num_obs line of the header of an obs_seq file.
+
+        Parameters:
+            header (list): A list of strings representing the lines in the header of the obs_seq file.
+
+        Returns:
+            int: The number of observations the header says are in the file, None if there is no num_obs line.
+        """
+        for line in header:
+            if "num_obs:" in line and "max_num_obs:" in line:
+                return int(line.split()[1])
+        return None
+
     @staticmethod
     def obs_reader(file, n):
-        """Reads the obs sequence file and returns a generator of the obs"""
-        previous_line = ''
-        with open(file, 'r') as f:     
-            for line in f:
-                if "OBS" in line or "OBS" in previous_line:
-                    if "OBS" in line:
-                        obs = []
-                        obs.append(line.strip()) 
-                        for i in range(n+100): # number of copies + 100.  Needs to be bigger than any metadata
-                            try:
-                                next_line = next(f)
-                            except:
-                                yield obs
-                                StopIteration
-                                return
-                            if "OBS" in next_line:
-                                previous_line = next_line
-                                break
-                            else:
-                                obs.append(next_line.strip())
-                        yield obs
-                    elif "OBS" in previous_line: # previous line is because I cannot use f.tell with next
-                        obs = []
-                        obs.append(previous_line.strip()) 
-                        obs.append(line.strip()) 
-                        for i in range(n+100): # number of copies + 100.  Needs to be bigger than any metadata
-                            try:
-                                next_line = next(f)
-                            except:
-                                yield obs
-                                StopIteration
-                                return
-                            if "OBS" in next_line:
-                                previous_line = next_line
-                                break
-                            else:
-                                obs.append(next_line.strip())
-                                previous_line = next_line
-                        yield obs
+        """Reads the obs sequence file and returns a generator of the obs
+
+           Each obs is the list of lines from its OBS line up to the next OBS line,
+           so obs specific metadata of any length is kept whole. The records are
+           delimited with one regular expression scan of the memory mapped file.
+           Lines are not stripped, obs_to_list ignores surrounding whitespace.
+
+           Raises ValueError if an obs has fewer lines than its n copies need.
+        """
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = _header_end.search(data).end()
+            starts = [marker.start() for marker in _obs_marker.finditer(data, header_end)]
+            for start, end in zip(starts, starts[1:] + [len(data)]):
+                obs = data[start:end].rstrip().decode().splitlines()
+                if len(obs) < n + 9: # OBS, copies, linked list, obdef, loc, location, kind, kind, time, obs error variance
+                    raise ValueError(f"Observation '{obs[0]}' is too short for {n} copies.")
+                yield obs
 
     def composite_types(self, composite_types='use_default'):
         """
@@ -369,15 +511,222 @@ class obs_sequence:
         if len(components) != len(set(components)):
             raise Exception("There are repeat values in components.")
 
-        df_comp = self.df[self.df['type'].str.upper().isin([component.upper() for component in components])]
-        df_no_comp = self.df[~self.df['type'].str.upper().isin([component.upper() for component in components])]
+        # upper case each distinct type once, rather than every row twice.
+        # For a Categorical type, isin then only compares the category codes
+        components_upper = {component.upper() for component in components}
+        types = self.df['type']
+        is_component = types.isin([t for t in types.unique() if t.upper() in components_upper])
+        df_comp = self.df[is_component]
+        df_no_comp = self.df[~is_component]
 
+        ensemble_columns = [col for col in df_comp.columns if 'ensemble' in col]
+        pieces = [df_no_comp]
         for key in self.composite_types_dict:
-            df_new = construct_composit(df_comp, key, self.composite_types_dict[key]['components'])
-            df_no_comp = pd.concat([df_no_comp, df_new], axis=0)
+            pieces.append(construct_composit(df_comp, key, self.composite_types_dict[key]['components'], ensemble_columns))
 
-        return df_no_comp
+        return pd.concat(pieces, axis=0)
         
+# buffer size for the line by line writes of obs_seq files. The 8 KiB
+# default means a system call every few observations.
+io_buffer_size = 1 << 22  # 4 MiB
+
+# dart time is seconds, days since the start of the Gregorian calendar
+_DART_EPOCH = dt.datetime(1601, 1, 1)
+
+# line ending the header of an obs_seq file, same test as read_header
+_header_end = re.compile(rb'^.*first:.*last:.*$', re.M)
+
+# start of each observation record.  Starting the patterns with the literal 'OBS'
+# lets the regular expression engine skip quickly between records.  Lines may end
+# in '\n' or '\r\n'.
+_obs_marker = re.compile(rb'OBS[ \t]+\d+[ \t]*\r?\n')
+
+# location type line of an observation record
+_loc_mod = re.compile(rb'\n[ \t]*(loc3d|loc1d)[ \t]*\r?\n')
+
+def obs_record_pattern(n, loc_mod):
+    """
+    Compile a regular expression matching one observation record with n copies.
+
+    The groups are obs_num, the copies, linked list info, the location, the kind,
+    seconds and days, and the observation error variance. Any observation specific
+    obs_def metadata between the kind and the time is skipped. Lines may end in
+    '\n' or '\r\n'.
+
+    Parameters:
+        n (int): The number of copies (including qc) in the observation sequence.
+        loc_mod (str): The location type of the observations, 'loc3d' or 'loc1d'.
+
+    Returns:
+        re.Pattern: The compiled pattern for bytes.
+    """
+    return re.compile(
+        rb'OBS[ \t]+(\d+)[ \t]*\r?\n'
+        rb'((?:[^\n]*\n){%d})'
+        rb'[ \t]*([^\n]*?)[ \t]*\r?\n'
+        rb'[ \t]*obdef[ \t]*\r?\n'
+        rb'[ \t]*%b[ \t]*\r?\n'
+        rb'([^\n]*)\n'
+        rb'[ \t]*kind[ \t]*\r?\n'
+        rb'[ \t]*(-?\d+)[ \t]*\r?\n'
+        rb'(?:[^\n]*\n)*?'
+        rb'([^\n]*)\n'
+        rb'([^\n]*)(?:\n|\Z)'
+        rb'(?=[ \t]*OBS[ \t]|\s*\Z)' % (n, loc_mod.encode()))
+
+def parse_numbers(fields, dtype=np.float64):
+    """
+    Parse a sequence of byte strings of whitespace separated numbers into one flat array.
+
+    All the numbers are converted by one call into numpy's C text parser.
+
+    Parameters:
+        fields (sequence of bytes): The text to parse, for example one group of every obs record.
+        dtype (numpy.dtype, optional): The type of the returned array. Defaults to float64.
+
+    Returns:
+        numpy.ndarray: All the numbers in fields, in order.
+
+    Raises:
+        ValueError: If fields contains anything that is not a number.
+    """
+    # np.fromstring only warns and stops at the first bad number
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(b'\n'.join(fields), dtype=dtype, sep=' ')
+        except DeprecationWarning:
+            raise ValueError("Could not parse the numbers in the observation sequence.") from None
+
+def parse_obs_seq_core(buf, n_copies, header_end, loc_mod, chunksize=20000, end=None, n_obs=None):
+    """
+    Parse every observation record of an ascii obs_seq file into preallocated arrays.
+
+    Each output array is allocated once at its final size, n_obs records, or the number of
+    OBS lines in buf if n_obs is not given. If the records found do not agree with n_obs,
+    for example a header with the wrong num_obs, buf is parsed again counting the records.
+    The records are matched chunksize at a time and every field of a chunk is converted in
+    one call, written straight into its slice of the output arrays.
+
+    Parameters:
+        buf (bytes-like): The contents of the obs_seq file, for example a mmap of the file.
+        n_copies (int): The number of copies (including qc) in the observation sequence.
+        header_end (int): The offset in buf of the end of the header, or of the OBS line of the first
+            record to parse.
+        loc_mod (str): The location type of every observation, 'loc3d' or 'loc1d'.
+        chunksize (int, optional): The number of records converted at a time. Defaults to 20000.
+        end (int, optional): The offset in buf where the records to parse end. Defaults to the end of buf.
+        n_obs (int, optional): The number of records expected, for example num_obs from the header.
+            Defaults to counting the OBS lines.
+
+    Returns:
+        tuple: The arrays obs_num[N], copies[N, n_copies] (column major), linked_list[N], loc[N, 3]
+        (loc[N, 1] for loc1d), vkind[N] (None for loc1d), kind[N], secs[N], days[N]
+        and err_var[N].
+
+    Raises:
+        ValueError: If any observation record could not be parsed, or chunksize is less than 1.
+    """
+    if chunksize < 1:
+        raise ValueError(f"chunksize must be at least 1, not {chunksize}.")
+    end = len(buf) if end is None else end
+    counted = n_obs is None
+    if counted:
+        n_obs = len(_obs_marker.findall(buf, header_end, end))
+    obs_num = np.empty(n_obs, dtype=np.int64)
+    copies = np.empty((n_copies, n_obs))  # one row per copy, so each copy is contiguous like a DataFrame column
+    linked_list = np.empty(n_obs, dtype=object)
+    loc = np.empty((n_obs, 4 if loc_mod == 'loc3d' else 1))
+    kind = np.empty(n_obs, dtype=np.int64)
+    time = np.empty((n_obs, 2), dtype=np.int64)
+    err_var = np.empty(n_obs)
+
+    records = obs_record_pattern(n_copies, loc_mod).finditer(buf, header_end, end)
+    start = 0
+    try:
+        while True:
+            chunk = [record.groups() for record in itertools.islice(records, chunksize)]
+            if not chunk:
+                break
+            stop = start + len(chunk)
+            if stop > n_obs:
+                if not counted:
+                    return parse_obs_seq_core(buf, n_copies, header_end, loc_mod, chunksize, end)
+                raise ValueError("Could not parse every observation in the observation sequence.")
+            chunk_obs_num, chunk_copies, chunk_linked_list, chunk_loc, chunk_kind, chunk_time, chunk_err_var = zip(*chunk)
+            del chunk
+            obs_num[start:stop] = parse_numbers(chunk_obs_num, np.int64)
+            copies[:, start:stop] = parse_numbers(chunk_copies).reshape(-1, n_copies).T
+            linked_list[start:stop] = b'\n'.join(chunk_linked_list).decode().split('\n')
+            loc[start:stop] = parse_numbers(chunk_loc).reshape(-1, loc.shape[1])
+            kind[start:stop] = parse_numbers(chunk_kind, np.int64)
+            time[start:stop] = parse_numbers(chunk_time, np.int64).reshape(-1, 2)
+            err_var[start:stop] = parse_numbers(chunk_err_var)
+            start = stop
+    finally:
+        # the iterator holds a buffer export, which would stop the caller closing an mmap
+        del records
+    if start != n_obs:
+        if not counted:
+            return parse_obs_seq_core(buf, n_copies, header_end, loc_mod, chunksize, end)
+        raise ValueError("Could not parse every observation in the observation sequence.")
+
+    if loc_mod == 'loc3d':
+        vkind = loc[:, 3].astype(int)
+        loc = loc[:, :3]
+    else:
+        vkind = None
+    return obs_num, copies.T, linked_list, loc, vkind, kind, time[:, 0], time[:, 1], err_var
+
+def parse_obs_seq_range(file, n_copies, start, end, loc_mod, chunksize=20000):
+    """parse_obs_seq_core of the records between offsets start and end of the obs_seq file"""
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return parse_obs_seq_core(data, n_copies, start, loc_mod, chunksize, end)
+
+def parse_obs_seq_parallel(file, n_copies, header_end, loc_mod, chunksize=20000, n_workers=None):
+    """
+    Parse every observation record of an ascii obs_seq file using several processes.
+
+    The records are split into n_workers ranges of about the same number of bytes, each
+    starting at an OBS line. Each worker process maps the file itself and parses its range
+    with parse_obs_seq_core, and the arrays from the workers are concatenated in order.
+
+    Parameters:
+        file (str): The obs_seq file.
+        n_copies (int): The number of copies (including qc) in the observation sequence.
+        header_end (int): The offset in the file of the end of the header.
+        loc_mod (str): The location type of every observation, 'loc3d' or 'loc1d'.
+        chunksize (int, optional): The number of records converted at a time by each worker. Defaults to 20000.
+        n_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        tuple: The same arrays as parse_obs_seq_core.
+
+    Raises:
+        ValueError: If any observation record could not be parsed.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    size = os.path.getsize(file)
+    bounds = [header_end]
+    with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for i in range(1, n_workers):
+            marker = _obs_marker.search(data, max(bounds[-1] + 1, header_end + (size - header_end) * i // n_workers))
+            if marker is None:
+                break
+            bounds.append(marker.start())
+    bounds.append(size)
+
+    with concurrent.futures.ProcessPoolExecutor(len(bounds) - 1) as pool:
+        parts = list(pool.map(parse_obs_seq_range, itertools.repeat(file), itertools.repeat(n_copies),
+                              bounds[:-1], bounds[1:], itertools.repeat(loc_mod), itertools.repeat(chunksize)))
+
+    obs_num, copies, linked_list, loc, vkind, kind, secs, days, err_var = zip(*parts)
+    del parts
+    copies = np.concatenate([part.T for part in copies], axis=1).T  # keep the copies column major
+    vkind = None if vkind[0] is None else np.concatenate(vkind)
+    return (np.concatenate(obs_num), copies, np.concatenate(linked_list), np.concatenate(loc), vkind,
+            np.concatenate(kind), np.concatenate(secs), np.concatenate(days), np.concatenate(err_var))
+
 def load_yaml_to_dict(file_path):
     """
     Load a YAML file and convert it to a dictionary.
@@ -403,7 +752,7 @@ def convert_dart_time(seconds, days):
         - base year for Gregorian calendar is 1601
         - dart time is seconds, days since 1601
     """
-    time = dt.datetime(1601,1,1) + dt.timedelta(days=days, seconds=seconds)
+    time = _DART_EPOCH + dt.timedelta(days=days, seconds=seconds)
     return time
     
 def select_by_dart_qc(df, dart_qc):
@@ -443,14 +792,14 @@ def possible_vs_used(df):
 
     This function takes a DataFrame containing observation data, including a 'type' column for the observation
     type and an 'observation' column. The number of used observations ('used'), is the total number
-    minus the observations that failed quality control checks (as determined by the `select_failed_qcs` function).
+    minus the observations that failed quality control checks (a DART quality control flag greater than 0, as in
+    the `select_failed_qcs` function).
     The result is a DataFrame with each observation type, the count of possible observations, and the count of
     used observations.
 
     Parameters:
         df (pd.DataFrame): A DataFrame with at least two columns: 'type' for the observation type and 'observation'
-        for the observation data. It may also contain other columns required by the `select_failed_qcs` function
-        to determine failed quality control checks.
+        for the observation data, and a 'DART_quality_control' column to determine failed quality control checks.
 
     Returns:
         pd.DataFrame: A DataFrame with three columns: 'type', 'possible', and 'used'. 'type' is the observation type,
@@ -458,14 +807,15 @@ def possible_vs_used(df):
         that passed quality control checks.
 
     """
-    possible = df.groupby('type')['observation'].count()
-    possible.rename('possible', inplace=True)
-    used = df.groupby('type')['observation'].count() - select_failed_qcs(df).groupby('type')['observation'].count()
-    used.rename('used', inplace=True)
-    return pd.concat([possible, used], axis=1).reset_index()
+    # one groupby pass counting both the possible and the failed observations
+    failed = df['observation'].notna() & (df['DART_quality_control'] > 0)  # same test as select_failed_qcs
+    counts = df[['type', 'observation']].assign(failed=failed).groupby('type', observed=True).agg(
+        possible=('observation', 'count'), failed=('failed', 'sum'))
+    counts['used'] = counts['possible'] - counts['failed']
+    return counts[['possible', 'used']].reset_index()
 
 
-def construct_composit(df_comp, composite, components):
+def construct_composit(df_comp, composite, components, ensemble_columns=None):
     """
     Construct a composite DataFrame by combining rows from two components.
 
@@ -477,6 +827,8 @@ def construct_composit(df_comp, composite, components):
         df_comp (pd.DataFrame): The DataFrame containing the component rows to be combined.
         composite (str): The type name for the new composite rows.
         components (list of str): A list containing the type names of the two components to be combined.
+        ensemble_columns (list of str, optional): The ensemble columns of df_comp to combine. Defaults to
+            every column with 'ensemble' in its name; pass them in when calling this for many composites.
 
     Returns:
         merged_df (pd.DataFrame): The updated DataFrame with the new composite rows added.
@@ -484,7 +836,9 @@ def construct_composit(df_comp, composite, components):
     selected_rows = df_comp[df_comp['type'] == components[0].upper()]
     selected_rows_v = df_comp[df_comp['type'] == components[1].upper()]
 
-    columns_to_combine = df_comp.filter(regex='ensemble').columns.tolist()
+    if ensemble_columns is None:
+        ensemble_columns = [col for col in df_comp.columns if 'ensemble' in col]
+    columns_to_combine = list(ensemble_columns)
     columns_to_combine.append('observation')  # TODO HK: bias, sq_err, obs_err_var
     merge_columns = ['latitude', 'longitude', 'vertical', 'time']
 
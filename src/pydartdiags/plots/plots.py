@@ -131,7 +131,7 @@ def mean_then_sqrt(x):
     return np.sqrt(np.mean(x))
 
 def rmse_bias(df):
-    rmse_bias_df = df.groupby(['hPa', 'type']).agg({'sq_err':mean_then_sqrt, 'bias':'mean'}).reset_index()
+    rmse_bias_df = df.groupby(['hPa', 'type'], observed=True).agg({'sq_err':mean_then_sqrt, 'bias':'mean'}).reset_index()
     rmse_bias_df.rename(columns={'sq_err':'rmse'}, inplace=True)
     
     return rmse_bias_df
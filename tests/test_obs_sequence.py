@@ -1,7 +1,239 @@
 import datetime as dt
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
 
 from pydartdiags.obs_sequence import obs_sequence as obs_seq
 
+obs_seq_header = """ obs_sequence
+obs_kind_definitions
+           2
+          13 RADIOSONDE_U_WIND_COMPONENT
+          14 RADIOSONDE_V_WIND_COMPONENT
+  num_copies:            2  num_qc:            1
+  num_obs:            3  max_num_obs:            3
+NCEP BUFR observation
+prior ensemble mean
+DART quality control
+  first:            1  last:            3
+"""
+
+obs_seq_loc3d = obs_seq_header + """ OBS            1
+   1.50000000000000
+   2.00000000000000
+   0.000000000000000E+000
+          -1           2          -1
+obdef
+loc3d
+     3.141592653589793        0.0000000000000000         50000.00000000000      2
+kind
+          13
+ 75603     153253
+   4.00000000000000
+ OBS            2
+   -1.5000000000000
+   -2.5000000000000
+   7.000000000000000
+           1           3          -1
+obdef
+loc3d
+     3.141592653589793        0.0000000000000000         50000.00000000000      2
+kind
+          14
+   obs specific metadata
+       12
+     0     153254
+   0.25000000000000
+ OBS            3
+   10.0000000000000
+   11.0000000000000
+   0.000000000000000E+000
+           2          -1          -1
+obdef
+loc3d
+     1.570796326794897        -0.7853981633974483         1.000000000000000     -1
+kind
+          13
+ 86399     153254
+   1.00000000000000
+"""
+
+obs_seq_loc1d = obs_seq_header.replace("num_obs:            3", "num_obs:            1") + """ OBS            1
+   0.50000000000000
+   0.75000000000000
+   0.000000000000000E+000
+          -1          -1          -1
+obdef
+loc1d
+  0.2500000000000000
+kind
+          14
+     0     0
+   2.00000000000000
+"""
+
+def test_read_loc3d(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file))
+
+    assert obs.loc_mod == 'loc3d'
+    assert len(obs.df) == 3
+    assert obs.df['obs_num'].tolist() == [1, 2, 3]
+    assert obs.df['observation'].tolist() == [1.5, -1.5, 10.0]
+    assert obs.df['DART_quality_control'].tolist() == [0.0, 7.0, 0.0]
+    assert obs.df['linked_list'].tolist()[1] == '1           3          -1'
+    np.testing.assert_allclose(obs.df['longitude'], [180.0, 180.0, 90.0])
+    np.testing.assert_allclose(obs.df['latitude'], [0.0, 0.0, -45.0])
+    assert obs.df['vert_unit'].tolist() == ['pressure (Pa)', 'pressure (Pa)', 'surface (m)']
+    assert obs.df['type'].tolist() == ['RADIOSONDE_U_WIND_COMPONENT', 'RADIOSONDE_V_WIND_COMPONENT',
+                                       'RADIOSONDE_U_WIND_COMPONENT']
+    # obs specific metadata is skipped
+    assert obs.df['seconds'].tolist() == [75603, 0, 86399]
+    assert obs.df['days'].tolist() == [153253, 153254, 153254]
+    assert obs.df['time'].iloc[1] == obs_seq.convert_dart_time(0, 153254)
+    assert obs.df['obs_err_var'].tolist() == [4.0, 0.25, 1.0]
+    assert obs.df['bias'].tolist() == [0.5, -1.0, 1.0]
+
+def test_read_parallel(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file))
+    for n_workers in [2, 3, 5]:
+        parallel = obs_seq.obs_sequence(str(file), n_workers=n_workers)
+        pd.testing.assert_frame_equal(parallel.df, obs.df)
+
+def test_read_crlf(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file))
+    crlf = tmp_path / "obs_seq.crlf"
+    crlf.write_bytes(obs_seq_loc3d.replace("\n", "\r\n").encode())
+    pd.testing.assert_frame_equal(obs_seq.obs_sequence(str(crlf)).df, obs.df)
+    assert len(list(obs_seq.obs_sequence.obs_reader(str(crlf), 3))) == 3
+
+def test_read_loc1d(tmp_path):
+    file = tmp_path / "obs_seq.loc1d"
+    file.write_text(obs_seq_loc1d)
+    obs = obs_seq.obs_sequence(str(file))
+
+    assert obs.loc_mod == 'loc1d'
+    assert obs.df['location'].tolist() == [0.25]
+    assert obs.df['type'].tolist() == ['RADIOSONDE_V_WIND_COMPONENT']
+    assert obs.df['time'].tolist() == [dt.datetime(1601, 1, 1)]
+    assert obs.df['obs_err_var'].tolist() == [2.0]
+
+def test_read_wrong_num_obs(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file))
+    for num_obs in [2, 5]:
+        file.write_text(obs_seq_loc3d.replace("num_obs:            3", f"num_obs:            {num_obs}"))
+        pd.testing.assert_frame_equal(obs_seq.obs_sequence(str(file)).df, obs.df)
+
+def test_obs_reader(tmp_path):
+    # obs specific metadata longer than the number of copies + 100 lines
+    long_metadata = "   obs specific metadata\n" + "       12\n" * 200
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d.replace("   obs specific metadata\n       12\n", long_metadata))
+    obs = list(obs_seq.obs_sequence.obs_reader(str(file), 3))
+    assert len(obs) == 3
+    assert len(obs[1]) == 12 + 201
+    assert obs[1][-2].split() == ['0', '153254']
+    assert obs[2][0].split() == ['OBS', '3']
+
+def test_write_over_source(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file))
+    obs.write_obs_seq(str(file))
+    written = obs_seq.obs_sequence(str(file))
+    # longitude and latitude go back to radians, so only match to rounding
+    pd.testing.assert_frame_equal(written.df, obs.df, check_exact=False, rtol=1e-14)
+    assert written.df['observation'].tolist() == obs.df['observation'].tolist()
+
+def test_read_cache(tmp_path):
+    pytest.importorskip("pyarrow")
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs = obs_seq.obs_sequence(str(file), cache=True)
+    assert (tmp_path / "obs_seq.loc3d.parquet").exists()
+
+    cached = obs_seq.obs_sequence(str(file), cache=True)
+    assert cached.loc_mod == 'loc3d'
+    pd.testing.assert_frame_equal(cached.df, obs.df)
+
+    # a pathlib.Path works the same as a str
+    cached = obs_seq.obs_sequence(file, cache=True)
+    pd.testing.assert_frame_equal(cached.df, obs.df)
+
+def test_read_cache_replaced_source(tmp_path):
+    pytest.importorskip("pyarrow")
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    obs_seq.obs_sequence(str(file), cache=True)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["obs_seq.loc3d", "obs_seq.loc3d.parquet"]
+
+    # a different file, dated before the cache was written
+    file.write_text(obs_seq_loc1d)
+    mtime = (tmp_path / "obs_seq.loc3d.parquet").stat().st_mtime - 86400
+    os.utime(file, (mtime, mtime))
+    obs = obs_seq.obs_sequence(str(file), cache=True)
+    assert obs.loc_mod == 'loc1d'
+    assert len(obs.df) == 1
+
+def test_read_cache_unreadable(tmp_path):
+    pytest.importorskip("pyarrow")
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    (tmp_path / "obs_seq.loc3d.parquet").write_bytes(b"not a parquet file")
+    with pytest.warns(UserWarning):
+        obs = obs_seq.obs_sequence(str(file), cache=True)
+    assert len(obs.df) == 3
+    # the bad cache is replaced
+    pd.testing.assert_frame_equal(obs_seq.obs_sequence(str(file), cache=True).df, obs.df)
+
+def test_read_cache_not_written(tmp_path, monkeypatch):
+    def no_parquet(*args, **kwargs):
+        raise ImportError("Unable to find a usable engine")
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", no_parquet)
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    with pytest.warns(UserWarning):
+        obs = obs_seq.obs_sequence(str(file), cache=True)
+    assert not (tmp_path / "obs_seq.loc3d.parquet").exists()
+    assert len(obs.df) == 3
+
+def test_read_unknown_vert(tmp_path):
+    file = tmp_path / "obs_seq.bad"
+    file.write_text(obs_seq_loc3d.replace("1.000000000000000     -1", "1.000000000000000     0"))
+    with pytest.raises(KeyError):
+        obs_seq.obs_sequence(str(file))
+
+def test_read_bad_number(tmp_path):
+    file = tmp_path / "obs_seq.bad"
+    file.write_text(obs_seq_loc3d.replace("   -2.5000000000000", "   -2.5.000000000000"))
+    # the bad number is in the second record, so with chunksize=1 the file is left
+    # part way through its records
+    for chunksize in [1, 20000]:
+        with pytest.raises(ValueError):
+            obs_seq.obs_sequence(str(file), chunksize=chunksize)
+
+def test_read_unparsable_obs(tmp_path):
+    file = tmp_path / "obs_seq.bad"
+    file.write_text(obs_seq_loc3d.replace("kind\n          14", "kind"))
+    for chunksize in [1, 20000]:
+        with pytest.raises(ValueError):
+            obs_seq.obs_sequence(str(file), chunksize=chunksize)
+
+def test_read_bad_chunksize(tmp_path):
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d)
+    with pytest.raises(ValueError):
+        obs_seq.obs_sequence(str(file), chunksize=0)
+
 
 def test_convert_dart_time():
     # Test case 1: Convert 0 seconds and 0 days
@@ -24,6 +256,57 @@ def test_convert_dart_time():
     expected = dt.datetime(2015, 1, 31, 0, 36, 4)
     assert result == expected
 
-    
+
+def test_possible_vs_used():
+    df = pd.DataFrame({
+        'type': ['A', 'A', 'B', 'B', 'B'],
+        'observation': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'DART_quality_control': [0, 7, 0, 0, 0]
+    })
+    result = obs_seq.possible_vs_used(df)
+    assert result['type'].tolist() == ['A', 'B']
+    assert result['possible'].tolist() == [2, 3]
+    # B has no failed observations
+    assert result['used'].tolist() == [1, 3]
+
+def test_possible_vs_used_order(tmp_path):
+    # kind 13 is V and kind 14 is U, the types must still come out by name
+    file = tmp_path / "obs_seq.loc3d"
+    file.write_text(obs_seq_loc3d.replace("13 RADIOSONDE_U", "13 RADIOSONDE_X").replace("14 RADIOSONDE_V", "14 RADIOSONDE_U")
+                                 .replace("13 RADIOSONDE_X", "13 RADIOSONDE_V"))
+    obs = obs_seq.obs_sequence(str(file))
+    assert obs.df['type'].tolist() == ['RADIOSONDE_V_WIND_COMPONENT', 'RADIOSONDE_U_WIND_COMPONENT',
+                                       'RADIOSONDE_V_WIND_COMPONENT']
+    result = obs_seq.possible_vs_used(obs.df)
+    assert result['type'].tolist() == ['RADIOSONDE_U_WIND_COMPONENT', 'RADIOSONDE_V_WIND_COMPONENT']
+    assert result['possible'].tolist() == [1, 2]
+    assert result['used'].tolist() == [0, 2]
+
+def test_construct_composit():
+    time = dt.datetime(2015, 1, 31)
+    df = pd.DataFrame({
+        'type': ['ACARS_U_WIND_COMPONENT', 'ACARS_V_WIND_COMPONENT', 'ACARS_V_WIND_COMPONENT'],
+        'latitude': [10.0, 10.0, 10.0],
+        'longitude': [0.0, -0.0, 5.0],
+        'vertical': [50000.0, 50000.0, 50000.0],
+        'time': [time, time, time],
+        'observation': [3.0, 4.0, 1.0],
+        'prior_ensemble_mean': [6.0, 8.0, 1.0]
+    })
+    result = obs_seq.construct_composit(df, 'acars_horizontal_wind',
+                                        ['acars_u_wind_component', 'acars_v_wind_component'])
+    assert len(result) == 1
+    assert result['type'].tolist() == ['ACARS_HORIZONTAL_WIND']
+    assert result['observation'].tolist() == [5.0]
+    assert result['prior_ensemble_mean'].tolist() == [10.0]
+    assert list(result.columns) == list(df.columns)
+
+    # any column types pandas can merge on
+    df = df.astype({'vertical': np.int32})
+    df['time'] = df['time'].dt.tz_localize('UTC')
+    result = obs_seq.construct_composit(df, 'acars_horizontal_wind',
+                                        ['acars_u_wind_component', 'acars_v_wind_component'])
+    assert result['observation'].tolist() == [5.0]
+
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file